@@ -12,6 +12,11 @@ import pandas as pd
 from webdriver_manager.chrome import ChromeDriverManager
 import requests
 import json
+import pickle
+import shutil
+from io import BytesIO
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
 try:
     from config import (
         SERVICE_ACCOUNT_CREDS, 
@@ -29,6 +34,13 @@ SHEET_ID = "1Ik8q-FptgJzx-Ya17WG6p8wwLQO_FUTdZQLQSmDQQNs"
 CHECK_INTERVAL = 3600  # Check every hour
 
 BTC_PRICE_CACHE_FILE = "btc_price_cache.json"
+BLOCK_METADATA_CACHE_FILE = "block_metadata_cache.json"
+BLOCK_EXPLORER_API = "https://mempool.space/api"
+BLOCK_FETCH_WORKERS = 8  # Maximum concurrent block explorer requests
+BLOCK_COLUMNS = ['Block Height', 'Block Time', 'Block Subsidy (BTC)', 'Block Fees (BTC)']
+SHEET_WRITE_CHUNK_ROWS = 5000  # Rows sent per Sheets values update request
+CHECKPOINT_DIR = "run_checkpoints"
+CHECKPOINT_MAX_AGE = 86400  # Discard unfinished runs older than a day
 
 def setup_driver():
     options = webdriver.ChromeOptions()
@@ -72,12 +84,11 @@ def get_ocean_data(driver):
             s.cookies.set(cookie['name'], cookie['value'])
         response = s.post(action_url)
         if response.status_code == 200:
-            from io import StringIO
-            csv_text = response.content.decode('utf-8')
-            df = pd.read_csv(StringIO(csv_text))
+            # Parse straight from the response bytes to avoid holding decoded copies of the CSV
+            df = pd.read_csv(BytesIO(response.content), encoding='utf-8')
             df['Time'] = pd.to_datetime(df['Time'])
             df['Share Log %'] = df['Share Log %'].str.rstrip('%').astype(float)
-            return df
+            return compact_frame(df)
         else:
             print("Failed to download earnings CSV via requests. Status code:", response.status_code)
             return None
@@ -104,10 +115,14 @@ def get_ocean_payouts(driver):
             s.cookies.set(cookie['name'], cookie['value'])
         response = s.post(action_url)
         if response.status_code == 200:
-            from io import StringIO
-            csv_text = response.content.decode('utf-8')
-            df = pd.read_csv(StringIO(csv_text))
-            return df
+            df = pd.read_csv(BytesIO(response.content), encoding='utf-8')
+            # Remove trailing semicolons from text values, leaving other values in mixed columns as they are
+            for col in df.select_dtypes(include=['object', 'string']).columns:
+                df[col] = df[col].map(lambda x: x.rstrip(';') if isinstance(x, str) else x)
+            # Convert the 'Time' column to datetime if it exists (needed for historical BTC price lookup)
+            if 'Time' in df.columns:
+                df['Time'] = pd.to_datetime(df['Time'], errors='coerce')
+            return compact_frame(df)
         else:
             print("Failed to download payouts CSV via requests. Status code:", response.status_code)
             return None
@@ -115,6 +130,41 @@ def get_ocean_payouts(driver):
         print(f"Error fetching Ocean payouts data: {str(e)}")
         return None
 
+def compact_frame(df):
+    # Downcast integer columns and store repeated strings as categoricals to keep the frame small.
+    # Float columns hold BTC amounts and prices, so they stay float64 to avoid losing precision.
+    for col in df.select_dtypes(include=['integer']).columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        if df[col].nunique() < len(df) / 2:
+            df[col] = df[col].astype('category')
+    return df
+
+def sheet_cells(column):
+    # Convert a column to plain Python values for the Sheets API, with missing values as blanks
+    return column.astype(object).where(column.notna(), '').tolist()
+
+def iter_frame_chunks(data):
+    # Yield (sheet row number, chunk) pairs for data rows, which start at row 5 after 4 header rows
+    for start in range(0, len(data), SHEET_WRITE_CHUNK_ROWS):
+        yield start + 5, data.iloc[start:start + SHEET_WRITE_CHUNK_ROWS]
+
+def write_sheet_rows(service, sheet_name, rows):
+    # Send rows in chunks of SHEET_WRITE_CHUNK_ROWS so the full request body is never built at once.
+    rows = iter(rows)
+    row_number = 1
+    while True:
+        chunk = list(islice(rows, SHEET_WRITE_CHUNK_ROWS))
+        if not chunk:
+            break
+        service.spreadsheets().values().update(
+            spreadsheetId=SHEET_ID,
+            range=f"'{sheet_name}'!A{row_number}",
+            valueInputOption='USER_ENTERED',
+            body={'values': chunk}
+        ).execute()
+        row_number += len(chunk)
+
 def load_btc_price_cache():
     try:
         if os.path.exists(BTC_PRICE_CACHE_FILE):
@@ -155,44 +205,217 @@ def get_historical_price(timestamp):
         print(f"Error fetching BTC price for timestamp {timestamp}: {str(e)}")
         return None
 
-def update_sheet(data):
-    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-    creds = service_account.Credentials.from_service_account_info(SERVICE_ACCOUNT_CREDS, scopes=SCOPES)
-    service = build('sheets', 'v4', credentials=creds)
-    sheet = service.spreadsheets()
-    
-    # Retrieve the sheetId for the "Earnings" sheet so that formatting only applies there
-    earnings_sheet_id = None
+# In-memory block metadata indexes keyed by block hash, one per cache file, loaded from disk on first use
+block_metadata_indexes = {}
+
+def load_block_metadata_cache(cache_file=BLOCK_METADATA_CACHE_FILE):
+    try:
+        if os.path.exists(cache_file):
+            with open(cache_file, "r") as file:
+                return json.load(file)
+    except json.JSONDecodeError:
+        print(f"Error: Invalid JSON format in {cache_file}. Creating a new cache file.")
+        return {}
+    return {}
+
+def save_block_metadata_cache(index, cache_file=BLOCK_METADATA_CACHE_FILE):
+    with open(cache_file, "w") as file:
+        json.dump(index, file, indent=4)
+
+def fetch_block_metadata(block_hash, api_url=BLOCK_EXPLORER_API):
+    response = requests.get(f"{api_url}/v1/block/{block_hash}", timeout=30)
+    response.raise_for_status()
+    block = response.json()
+    # Esplora-style explorers send no extras, and some send "extras": null
+    extras = block.get('extras') or {}
+    reward = extras.get('reward')
+    fees = extras.get('totalFees')
+    # Amounts are kept in satoshis in the index and converted to BTC when joined
+    return {
+        'height': block['height'],
+        'timestamp': block['timestamp'],
+        'subsidy': reward - fees if reward is not None and fees is not None else None,
+        'fees': fees
+    }
+
+def get_block_metadata(block_hashes, api_url=BLOCK_EXPLORER_API, cache_file=BLOCK_METADATA_CACHE_FILE):
+    # Return a DataFrame of block metadata indexed by block hash. Blocks missing from the
+    # index are fetched in bulk with bounded concurrency and the index is saved once afterwards.
+    # Pass a separate cache_file when pointing api_url at a stand-in explorer, so its data
+    # never ends up in the production cache.
+    if cache_file not in block_metadata_indexes:
+        block_metadata_indexes[cache_file] = load_block_metadata_cache(cache_file)
+    block_metadata_index = block_metadata_indexes[cache_file]
+
+    hashes = pd.Series(block_hashes).dropna().astype(str).unique()
+    missing = [h for h in hashes if h not in block_metadata_index]
+    # Records without subsidy or fees are used for this run only and fetched again next time
+    partial_records = {}
+    if missing:
+        print(f"Fetching metadata for {len(missing)} blocks")
+        try:
+            with ThreadPoolExecutor(max_workers=BLOCK_FETCH_WORKERS) as executor:
+                futures = {executor.submit(fetch_block_metadata, h, api_url): h for h in missing}
+                for future in as_completed(futures):
+                    block_hash = futures[future]
+                    try:
+                        record = future.result()
+                    except (requests.exceptions.RequestException, KeyError, TypeError, ValueError) as e:
+                        print(f"Error fetching metadata for block {block_hash}: {str(e)}")
+                        continue
+                    if record['subsidy'] is None or record['fees'] is None:
+                        partial_records[block_hash] = record
+                    else:
+                        block_metadata_index[block_hash] = record
+        finally:
+            # Keep every block fetched so far, even if the batch is interrupted
+            save_block_metadata_cache(block_metadata_index, cache_file)
+
+    records = {h: block_metadata_index.get(h) or partial_records[h]
+               for h in hashes if h in block_metadata_index or h in partial_records}
+    blocks = pd.DataFrame.from_dict(records, orient='index', columns=['height', 'timestamp', 'subsidy', 'fees'])
+    return pd.DataFrame({
+        'Block Height': pd.to_numeric(blocks['height']).astype('Int64'),
+        'Block Time': pd.to_datetime(blocks['timestamp'], unit='s'),
+        'Block Subsidy (BTC)': pd.to_numeric(blocks['subsidy']) / 1e8,
+        'Block Fees (BTC)': pd.to_numeric(blocks['fees']) / 1e8
+    }, index=blocks.index)
+
+def start_run():
+    # Resume the most recent unfinished run if there is one, otherwise start a new run.
+    # Finished runs are removed by finish_run, so any directory left behind is resumable.
+    if os.path.exists(CHECKPOINT_DIR):
+        for run_id in sorted(os.listdir(CHECKPOINT_DIR), reverse=True):
+            run_path = os.path.join(CHECKPOINT_DIR, run_id)
+            if not os.path.isdir(run_path):
+                continue
+            if time.time() - os.path.getmtime(run_path) > CHECKPOINT_MAX_AGE:
+                print(f"Discarding stale checkpoints for run {run_id}")
+                shutil.rmtree(run_path, ignore_errors=True)
+                continue
+            print(f"Resuming unfinished run {run_id}")
+            return run_id
+    run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    os.makedirs(os.path.join(CHECKPOINT_DIR, run_id), exist_ok=True)
+    return run_id
+
+def finish_run(run_id):
+    shutil.rmtree(os.path.join(CHECKPOINT_DIR, run_id), ignore_errors=True)
+
+def run_has_checkpoints(run_id):
+    run_path = os.path.join(CHECKPOINT_DIR, run_id)
+    return os.path.isdir(run_path) and any(name.endswith(".pkl") for name in os.listdir(run_path))
+
+def clear_checkpoints(run_id, sheet):
+    # Drop every checkpoint of a sheet once it has been written. Nothing is left to resume for it,
+    # so a resumed run fetches that sheet again instead of rewriting stale data.
+    run_path = os.path.join(CHECKPOINT_DIR, run_id)
+    if not os.path.isdir(run_path):
+        return
+    for name in os.listdir(run_path):
+        if name.startswith(f"{sheet}_"):
+            os.remove(os.path.join(run_path, name))
+
+def checkpoint_path(run_id, stage):
+    return os.path.join(CHECKPOINT_DIR, run_id, f"{stage}.pkl")
+
+def save_checkpoint(run_id, stage, obj):
+    # Write to a temporary file first so an interrupted save never leaves a truncated checkpoint.
+    path = checkpoint_path(run_id, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as file:
+        pickle.dump(obj, file)
+    os.replace(path + ".tmp", path)
+
+def load_checkpoint(run_id, stage):
+    path = checkpoint_path(run_id, stage)
+    try:
+        with open(path, "rb") as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # Any failure to unpickle (truncated file, or a frame pickled by another pandas version)
+        # means the checkpoint is unusable, so drop it and re-run the stage.
+        print(f"Error: Corrupt checkpoint '{stage}' for run {run_id} ({str(e)}). Re-running that stage.")
+        os.remove(path)
+        return None
+
+def run_stage(run_id, stage, func, *args):
+    # Return the checkpointed result of a stage, or run it and checkpoint the result.
+    # A None result is treated as a failure and is not checkpointed, so the stage is retried next run.
+    result = load_checkpoint(run_id, stage)
+    if result is not None:
+        print(f"Loaded '{stage}' from checkpoint")
+        return result
+    result = func(*args)
+    if result is not None:
+        save_checkpoint(run_id, stage, result)
+    return result
+
+def write_sheet_staged(service, sheet_id, title, rows, row_count, column_count):
+    # Write rows into a fresh staging tab first. Only once that has succeeded, resize the real tab,
+    # copy the staging grid over it and delete the staging tab in a single batchUpdate, which the
+    # Sheets API applies atomically. A failed write leaves the real tab untouched, and the real tab
+    # keeps its sheetId, so charts, named ranges and links to it survive every update.
+    staging_title = f"{title} (staging)"
     spreadsheet = service.spreadsheets().get(spreadsheetId=SHEET_ID).execute()
+    setup_requests = []
     for s in spreadsheet.get("sheets", []):
-        if s["properties"]["title"] == "Earnings":
-            earnings_sheet_id = s["properties"]["sheetId"]
-            break
-    if earnings_sheet_id is None:
-        # If no "Earnings" sheet exists, create one.
-        add_sheet_request = {
+        # A staging tab left behind by a failed run only holds a partial write, so start over
+        if s["properties"]["title"] == staging_title:
+            setup_requests.append({"deleteSheet": {"sheetId": s["properties"]["sheetId"]}})
+    setup_requests.append({
+        "addSheet": {
+            "properties": {
+                "title": staging_title,
+                "gridProperties": {
+                    "rowCount": row_count,
+                    "columnCount": column_count
+                }
+            }
+        }
+    })
+    response = service.spreadsheets().batchUpdate(
+        spreadsheetId=SHEET_ID,
+        body={"requests": setup_requests}
+    ).execute()
+    staging_sheet_id = response["replies"][-1]["addSheet"]["properties"]["sheetId"]
+
+    write_sheet_rows(service, staging_title, rows)
+
+    grid = {"startRowIndex": 0, "endRowIndex": row_count, "startColumnIndex": 0, "endColumnIndex": column_count}
+    service.spreadsheets().batchUpdate(
+        spreadsheetId=SHEET_ID,
+        body={
             "requests": [
                 {
-                    "addSheet": {
+                    # Resizing drops stale rows and columns beyond the new data
+                    "updateSheetProperties": {
                         "properties": {
-                            "title": "Earnings",
-                            "gridProperties": {
-                                "rowCount": 1000,
-                                "columnCount": 11
-                            }
-                        }
+                            "sheetId": sheet_id,
+                            "gridProperties": {"rowCount": row_count, "columnCount": column_count}
+                        },
+                        "fields": "gridProperties(rowCount,columnCount)"
                     }
-                }
+                },
+                {"unmergeCells": {"range": {"sheetId": sheet_id, **grid}}},
+                {
+                    # PASTE_NORMAL also replaces the old formatting with the staging tab's blank formatting
+                    "copyPaste": {
+                        "source": {"sheetId": staging_sheet_id, **grid},
+                        "destination": {"sheetId": sheet_id, **grid},
+                        "pasteType": "PASTE_NORMAL"
+                    }
+                },
+                {"deleteSheet": {"sheetId": staging_sheet_id}}
             ]
         }
-        response = service.spreadsheets().batchUpdate(
-            spreadsheetId=SHEET_ID,
-            body=add_sheet_request
-        ).execute()
-        earnings_sheet_id = response["replies"][0]["addSheet"]["properties"]["sheetId"]
-        print("Created new 'Earnings' sheet with sheetId:", earnings_sheet_id)
-    
-    # Get current BTC price safely
+    ).execute()
+
+def get_report_header():
+    # The current BTC price and report timestamp are looked up when a sheet is written, never
+    # checkpointed, so a resumed run does not publish the price from when it was interrupted
     try:
         current_btc_price = get_historical_price(pd.Timestamp.now()) or ''
     except:
@@ -209,110 +432,128 @@ def update_sheet(data):
     price_header_row = [f'BTC Price: {current_btc_price_formatted}', '', '', '', '', '', '', '', '', '', '']
     empty_row = ['', '', '', '', '', '', '', '', '', '', '']
     
-    headers = [['Time', 'Block', 'Share %', 'Share Count', 'Earnings (BTC)', 'Pool Fees (BTC)', 'BTC Price (USD)', 'Cost Basis (USD)', 'Pool Fees Cost Basis (USD)', 'Current Value (USD)', 'Gain/Loss (USD)']]
-    
-    # Format data
-    data['Block'] = data['Block'].apply(lambda x: f'=HYPERLINK("https://mempool.space/block/{x}", "{x}")')
-    
+    return current_btc_price, [report_header_row, price_header_row, empty_row]
+
+def get_earnings_prices(data):
     # Fetch historical BTC prices for each timestamp
-    data['BTC Price (USD)'] = data['Time'].apply(get_historical_price)
-    
-    # Update the data DataFrame to include formulas for Cost Basis and Pool Fees Cost Basis
-    data['Cost Basis (USD)'] = data.apply(lambda row: f'=E{row.name + 5}*G{row.name + 5}', axis=1)
-    data['Pool Fees Cost Basis (USD)'] = data.apply(lambda row: f'=F{row.name + 5}*G{row.name + 5}', axis=1)
-    
-    data['Time'] = data['Time'].dt.strftime('%m/%d/%y %H:%M:%S')
-    data = data.replace({float('nan'): '', 'NaN': ''})
+    return data['Time'].apply(get_historical_price)
+
+def get_earnings_blocks(data):
+    return get_block_metadata(data['Block'])
+
+def build_earnings_payload(data, btc_prices, blocks):
+    # Attach the BTC prices and join block metadata onto the earnings rows in a single merge.
+    # Cells stay in their typed columns; formulas and display strings are only built per chunk
+    # by iter_earnings_rows while the sheet is written.
+    data = data.assign(**{'BTC Price (USD)': pd.to_numeric(btc_prices, errors='coerce')})
+    block_data = blocks.reindex(data['Block'].astype(str)).set_axis(data.index)
+    data = pd.concat([data, block_data], axis=1)
     
     # Define table header row for the Earnings sheet with additional columns:
-    earnings_headers = ['Time', 'Block', 'Share %', 'Share Count', 'Earnings (BTC)', 'Pool Fees (BTC)', 'BTC Price (USD)', 'Cost Basis (USD)', 'Pool Fees Cost Basis (USD)', 'Current Value (USD)', 'Gain/Loss (USD)']
+    earnings_headers = ['Time', 'Block', 'Share %', 'Share Count', 'Earnings (BTC)', 'Pool Fees (BTC)', 'BTC Price (USD)', 'Cost Basis (USD)', 'Pool Fees Cost Basis (USD)', 'Current Value (USD)', 'Gain/Loss (USD)'] + BLOCK_COLUMNS
     
-    # Prepare final values by combining header rows with the data rows
-    values = [report_header_row, price_header_row, empty_row, earnings_headers] + data.values.tolist()
-    
-    totals_row_index = len(values) + 1
+    # Data rows start at row 5 (after 4 header rows), followed by the totals row.
+    # The BTC Price (USD) cell is filled in with the current price by iter_earnings_rows.
+    totals_row_index = len(data) + 5
     totals_row = [
         'Total', '', '', '', 
         f'=SUM(E5:E{totals_row_index - 1})', 
         f'=SUM(F5:F{totals_row_index - 1})', 
-        current_btc_price, 
+        '', 
         f'=SUM(H5:H{totals_row_index - 1})', 
         f'=SUM(I5:I{totals_row_index - 1})', 
         f'=SUM(J5:J{totals_row_index - 1})', 
         f'=SUM(K5:K{totals_row_index - 1})'
     ]
-    values.append(totals_row)
-    
-    # Calculate formulas for Current Value and Gain/Loss for each data row.
-    # (Assumes data rows start at row 5; adjust the offset if needed.)
-    current_value_formulas = [f'=E{row + 5}*$G${totals_row_index}' for row in range(len(data))]
-    gain_loss_formulas = [f'=J{row + 5}-H{row + 5}' for row in range(len(data))]
-
-    for row, formula in zip(data.itertuples(index=True), current_value_formulas):
-        values[row.Index + 4].append(formula)
-    for row, formula in zip(data.itertuples(index=True), gain_loss_formulas):
-        values[row.Index + 4].append(formula)
+
+    return {
+        'headers': earnings_headers,
+        'data': data,
+        'totals_row': totals_row,
+        'totals_row_index': totals_row_index
+    }
+
+def iter_earnings_rows(payload, current_btc_price, header_rows):
+    data = payload['data']
+    totals_row_index = payload['totals_row_index']
+    base_columns = [col for col in data.columns if col not in BLOCK_COLUMNS]
+
+    yield from header_rows
+    yield payload['headers']
+    for first_row, chunk in iter_frame_chunks(data):
+        chunk = chunk.assign(**{
+            'Time': chunk['Time'].dt.strftime('%m/%d/%y %H:%M:%S'),
+            'Block': [f'=HYPERLINK("https://mempool.space/block/{x}", "{x}")' for x in chunk['Block']],
+            'Block Time': chunk['Block Time'].dt.strftime('%m/%d/%y %H:%M:%S')
+        })
+        base_cells = zip(*(sheet_cells(chunk[col]) for col in base_columns))
+        block_cells = zip(*(sheet_cells(chunk[col]) for col in BLOCK_COLUMNS))
+        for row, base_row, block_row in zip(range(first_row, first_row + len(chunk)), base_cells, block_cells):
+            # Cost Basis, Pool Fees Cost Basis, Current Value and Gain/Loss formulas for this row
+            yield [
+                *base_row,
+                f'=E{row}*G{row}',
+                f'=F{row}*G{row}',
+                f'=E{row}*$G${totals_row_index}',
+                f'=J{row}-H{row}',
+                *block_row
+            ]
+    totals_row = list(payload['totals_row'])
+    totals_row[6] = current_btc_price
+    yield totals_row
+
+def update_sheet(payload):
+    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+    creds = service_account.Credentials.from_service_account_info(SERVICE_ACCOUNT_CREDS, scopes=SCOPES)
+    service = build('sheets', 'v4', credentials=creds)
     
-    # Unmerge all cells in the range where the earnings sheet will be updated.
-    # This ensures that any merged cells—including those in the last data row—are unmerged.
-    sheet.batchUpdate(
-        spreadsheetId=SHEET_ID,
-        body={
+    # Retrieve the sheetId for the "Earnings" sheet so that formatting only applies there
+    earnings_sheet_id = None
+    spreadsheet = service.spreadsheets().get(spreadsheetId=SHEET_ID).execute()
+    for s in spreadsheet.get("sheets", []):
+        if s["properties"]["title"] == "Earnings":
+            earnings_sheet_id = s["properties"]["sheetId"]
+            break
+    if earnings_sheet_id is None:
+        # If no "Earnings" sheet exists, create one.
+        add_sheet_request = {
             "requests": [
                 {
-                    "unmergeCells": {
-                        "range": {
-                            "sheetId": earnings_sheet_id,
-                            "startRowIndex": 0,
-                            "endRowIndex": len(values),  # Unmerge all rows in the updated range
-                            "startColumnIndex": 0,
-                            "endColumnIndex": 11         # Earnings sheet has 11 columns
+                    "addSheet": {
+                        "properties": {
+                            "title": "Earnings",
+                            "gridProperties": {
+                                "rowCount": 1000,
+                                "columnCount": 15
+                            }
                         }
                     }
                 }
             ]
         }
-    ).execute()
+        response = service.spreadsheets().batchUpdate(
+            spreadsheetId=SHEET_ID,
+            body=add_sheet_request
+        ).execute()
+        earnings_sheet_id = response["replies"][0]["addSheet"]["properties"]["sheetId"]
+        print("Created new 'Earnings' sheet with sheetId:", earnings_sheet_id)
     
-    # Clear and update
-    service.spreadsheets().values().clear(
-        spreadsheetId=SHEET_ID,
-        range='Earnings!A1:F',
-        body={}
-    ).execute()
-
-    # Update values
-    update_body = {'values': values}
-    service.spreadsheets().values().update(
-        spreadsheetId=SHEET_ID,
-        range='Earnings!A1',
-        valueInputOption='USER_ENTERED',
-        body=update_body
-    ).execute()
-
-    # Clear existing formatting
-    clear_format_body = {
-        "requests": [
-            {
-                "repeatCell": {
-                    "range": {"sheetId": 0, "startRowIndex": 1, "endRowIndex": len(values)},
-                    "cell": {"userEnteredFormat": {}},
-                    "fields": "userEnteredFormat"
-                }
-            }
-        ]
-    }
-    service.spreadsheets().batchUpdate(
-        spreadsheetId=SHEET_ID,
-        body=clear_format_body
-    ).execute()
+    totals_row_index = payload['totals_row_index']
+    current_btc_price, header_rows = get_report_header()
+
+    # Write the rows through a staging tab so a failed write never leaves the tab empty or half updated
+    write_sheet_staged(
+        service, earnings_sheet_id, 'Earnings', iter_earnings_rows(payload, current_btc_price, header_rows),
+        row_count=totals_row_index,
+        column_count=15  # Earnings sheet has 15 columns
+    )
     
     # Apply new formatting
     format_body = {
         "requests": [
             {
                 "repeatCell": {
-                    "range": {"sheetId": 0, "startRowIndex": 0, "endRowIndex": 2},
+                    "range": {"sheetId": earnings_sheet_id, "startRowIndex": 0, "endRowIndex": 2},
                     "cell": {"userEnteredFormat": {"textFormat": {"bold": True}, "horizontalAlignment": "LEFT"}},
                     "fields": "userEnteredFormat(textFormat,horizontalAlignment)"
                 }
@@ -320,7 +561,7 @@ def update_sheet(data):
             {
                 "mergeCells": {
                     "range": {
-                        "sheetId": 0,
+                        "sheetId": earnings_sheet_id,
                         "startRowIndex": totals_row_index - 1,
                         "endRowIndex": totals_row_index,
                         "startColumnIndex": 0,
@@ -331,21 +572,21 @@ def update_sheet(data):
             },
             {
                 "repeatCell": {
-                    "range": {"sheetId": 0, "startRowIndex": totals_row_index - 1, "endRowIndex": totals_row_index},
+                    "range": {"sheetId": earnings_sheet_id, "startRowIndex": totals_row_index - 1, "endRowIndex": totals_row_index},
                     "cell": {"userEnteredFormat": {"textFormat": {"bold": True}, "horizontalAlignment": "RIGHT"}},
                     "fields": "userEnteredFormat(textFormat,horizontalAlignment)"
                 }
             },
             {
                 "repeatCell": {
-                    "range": {"sheetId": 0, "startRowIndex": 4, "endRowIndex": totals_row_index, "startColumnIndex": 0, "endColumnIndex": 1},
+                    "range": {"sheetId": earnings_sheet_id, "startRowIndex": 4, "endRowIndex": totals_row_index, "startColumnIndex": 0, "endColumnIndex": 1},
                     "cell": {"userEnteredFormat": {"numberFormat": {"type": "DATE_TIME"}}},
                     "fields": "userEnteredFormat.numberFormat"
                 }
             },
             {
                 "repeatCell": {
-                    "range": {"sheetId": 0, "startRowIndex": 4, "endRowIndex": totals_row_index, "startColumnIndex": 6, "endColumnIndex": 11},
+                    "range": {"sheetId": earnings_sheet_id, "startRowIndex": 4, "endRowIndex": totals_row_index, "startColumnIndex": 6, "endColumnIndex": 11},
                     "cell": {"userEnteredFormat": {"numberFormat": {"type": "CURRENCY", "pattern": "$#,##0.00"}}},
                     "fields": "userEnteredFormat.numberFormat"
                 }
@@ -353,7 +594,7 @@ def update_sheet(data):
             {
                 "addConditionalFormatRule": {
                     "rule": {
-                        "ranges": [{"sheetId": 0, "startRowIndex": 4, "endRowIndex": totals_row_index, "startColumnIndex": 10, "endColumnIndex": 11}],
+                        "ranges": [{"sheetId": earnings_sheet_id, "startRowIndex": 4, "endRowIndex": totals_row_index, "startColumnIndex": 10, "endColumnIndex": 11}],
                         "booleanRule": {
                             "condition": {"type": "NUMBER_LESS", "values": [{"userEnteredValue": "0"}]},
                             "format": {
@@ -366,7 +607,7 @@ def update_sheet(data):
             {
                 "addConditionalFormatRule": {
                     "rule": {
-                        "ranges": [{"sheetId": 0, "startRowIndex": 4, "endRowIndex": totals_row_index, "startColumnIndex": 10, "endColumnIndex": 11}],
+                        "ranges": [{"sheetId": earnings_sheet_id, "startRowIndex": 4, "endRowIndex": totals_row_index, "startColumnIndex": 10, "endColumnIndex": 11}],
                         "booleanRule": {
                             "condition": {"type": "NUMBER_GREATER", "values": [{"userEnteredValue": "0"}]},
                             "format": {
@@ -378,7 +619,7 @@ def update_sheet(data):
             },
             {
                 "repeatCell": {
-                    "range": {"sheetId": 0, "startRowIndex": 3, "endRowIndex": 4},
+                    "range": {"sheetId": earnings_sheet_id, "startRowIndex": 3, "endRowIndex": 4},
                     "cell": {"userEnteredFormat": {"wrapStrategy": "WRAP"}},
                     "fields": "userEnteredFormat.wrapStrategy"
                 }
@@ -390,62 +631,25 @@ def update_sheet(data):
         body=format_body
     ).execute()
 
-def update_sheet_payouts(data):
-    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-    creds = service_account.Credentials.from_service_account_info(
-        SERVICE_ACCOUNT_CREDS, scopes=SCOPES)
-    service = build('sheets', 'v4', credentials=creds)
-    
-    # Retrieve the sheetId for the "Payouts" sheet so that formatting only applies there
-    payouts_sheet_id = None
-    spreadsheet = service.spreadsheets().get(spreadsheetId=SHEET_ID).execute()
-    for sheet in spreadsheet.get("sheets", []):
-        if sheet["properties"]["title"] == "Payouts":
-            payouts_sheet_id = sheet["properties"]["sheetId"]
-            break
-    if payouts_sheet_id is None:
-        # If no "Payouts" sheet exists, create one.
-        add_sheet_request = {
-            "requests": [
-                {
-                    "addSheet": {
-                        "properties": {
-                            "title": "Payouts",
-                            "gridProperties": {
-                                "rowCount": 1000,
-                                "columnCount": 26
-                            }
-                        }
-                    }
-                }
-            ]
-        }
-        response = service.spreadsheets().batchUpdate(
-            spreadsheetId=SHEET_ID,
-            body=add_sheet_request
-        ).execute()
-        payouts_sheet_id = response["replies"][0]["addSheet"]["properties"]["sheetId"]
-        print("Created new 'Payouts' sheet with sheetId:", payouts_sheet_id)
-    
-    # Clean data: replace NaN with empty strings and remove trailing semicolons from text values.
-    data = data.fillna('')
-    for col in data.select_dtypes(include=['object']).columns:
-        data[col] = data[col].apply(lambda x: x.rstrip(';') if isinstance(x, str) else x)
+def get_payout_prices(data):
+    # Fetch historical BTC prices for each payout timestamp
+    if 'Time' not in data.columns:
+        return pd.Series(None, index=data.index, dtype=object)
+    times = pd.to_datetime(data['Time'], errors='coerce')
+    return times.apply(lambda t: get_historical_price(t) if pd.notna(t) else None)
 
-    # Convert the 'Time' column to datetime if it exists (needed for historical BTC price lookup)
-    if 'Time' in data.columns:
-        data['Time'] = pd.to_datetime(data['Time'], errors='coerce')
+def build_payouts_payload(data, btc_prices):
+    # Text values were cleaned and 'Time' parsed when the CSV was fetched (see get_ocean_payouts).
+    # Missing values are left as NaN and written as blanks by iter_payouts_rows.
+    btc_prices = pd.to_numeric(btc_prices, errors='coerce')
+    amounts = pd.to_numeric(data["Amount (BTC)"], errors='coerce') if "Amount (BTC)" in data.columns else None
 
     # Compute cost basis (USD) for each payout row if the payout amount column exists.
     # Assumes the CSV has a column named "Payout (BTC)" containing the payout amount in BTC.
-    if "Amount (BTC)" in data.columns:
-        data["Cost Basis (USD)"] = data.apply(
-            lambda row: float(row["Amount (BTC)"]) * get_historical_price(row["Time"])
-                        if row["Amount (BTC)"] not in ['', None] else '',
-            axis=1
-        )
+    if amounts is not None:
+        data = data.assign(**{"Cost Basis (USD)": amounts * btc_prices})
     else:
-        data["Cost Basis (USD)"] = ''
+        data = data.assign(**{"Cost Basis (USD)": float('nan')})
 
     # Reorder the DataFrame columns so that "Cost Basis (USD)" is inserted as the 5th column (index 4)
     cols = list(data.columns)
@@ -454,22 +658,9 @@ def update_sheet_payouts(data):
         cols.insert(4, "Cost Basis (USD)")
         data = data[cols]
 
-    # Compute current BTC price to use for gain/loss calculation
-    try:
-        current_btc_price_float = get_historical_price(pd.Timestamp.now())
-    except Exception as e:
-        current_btc_price_float = None
-
-    # Compute Gain/Loss (USD) for each payout row using:
-    # Gain/Loss = Amount (BTC) * (current BTC price - historical BTC price)
-    if "Amount (BTC)" in data.columns and current_btc_price_float:
-        data["Gain/Loss (USD)"] = data.apply(
-            lambda row: float(row["Amount (BTC)"]) * (current_btc_price_float - get_historical_price(row["Time"]))
-                        if row["Amount (BTC)"] not in ['', None] else '',
-            axis=1
-        )
-    else:
-        data["Gain/Loss (USD)"] = ''
+    # Gain/Loss (USD) depends on the current BTC price, so it is only filled in by iter_payouts_rows
+    # when the sheet is written. Keep the column here so the headers and totals row line up.
+    data = data.assign(**{"Gain/Loss (USD)": float('nan')})
 
     # Reorder the DataFrame columns so that "Gain/Loss (USD)" is inserted as the 6th column (index 5)
     cols = list(data.columns)
@@ -478,33 +669,11 @@ def update_sheet_payouts(data):
         cols.insert(5, "Gain/Loss (USD)")
         data = data[cols]
 
-    # Format the 'Time' column as a string for the sheet display
-    if 'Time' in data.columns:
-        data['Time'] = data['Time'].dt.strftime('%m/%d/%y %H:%M:%S')
-
-    # Get current BTC price safely
-    try:
-        current_btc_price = get_historical_price(pd.Timestamp.now()) or ''
-    except:
-        current_btc_price = ''
-    current_btc_price_formatted = f'${current_btc_price:,.2f}' if current_btc_price else ''
-    
-    # Get current timestamp in human-readable format
-    current_timestamp = datetime.now().strftime('%B %d, %Y %I:%M %p')
-    
-    # Create header rows
-    report_header_row = [f'Report as of: {current_timestamp}', '', '', '', '', '', '', '', '', '', '']
-    price_header_row = [f'BTC Price: {current_btc_price_formatted}', '', '', '', '', '', '', '', '', '', '']
-    empty_row = ['', '', '', '', '', '', '', '', '', '', '']
-
     # Use the payouts CSV's header row as the table header row
     payouts_headers = list(data.columns)
 
-    # Combine header rows with the data rows
-    values = [report_header_row, price_header_row, empty_row, payouts_headers] + data.values.tolist()
-    
     # Calculate the 1-indexed row number where the totals row will go.
-    totals_row_index = len(values) + 1  
+    totals_row_index = len(data) + 5
     num_cols = len(payouts_headers)
 
     # Initialize totals row with empty strings and set first cell to "Total"
@@ -529,43 +698,77 @@ def update_sheet_payouts(data):
             col = col_letter(i + 1)
             totals_row[i] = f"=SUM({col}{start_data_row}:{col}{end_data_row})"
 
-    values.append(totals_row)
-    
-    # Clear existing data in the "Payouts" sheet (ensure that a sheet named 'Payouts' exists)
-    service.spreadsheets().values().clear(
-        spreadsheetId=SHEET_ID,
-        range='Payouts!A1:Z',
-        body={}
-    ).execute()
-
-    # Update the "Payouts" sheet with header rows, data rows, and totals row
-    update_body = {'values': values}
-    service.spreadsheets().values().update(
-        spreadsheetId=SHEET_ID,
-        range='Payouts!A1',
-        valueInputOption='USER_ENTERED',
-        body=update_body
-    ).execute()
+    return {
+        'headers': payouts_headers,
+        'data': data,
+        'totals_row': totals_row,
+        'totals_row_index': totals_row_index
+    }
 
-    # Unmerge all cells in the updated range on the Payouts sheet.
-    service.spreadsheets().batchUpdate(
-        spreadsheetId=SHEET_ID,
-        body={
+def iter_payouts_rows(payload, current_btc_price, header_rows):
+    yield from header_rows
+    yield payload['headers']
+    for _, chunk in iter_frame_chunks(payload['data']):
+        # Format the 'Time' column as a string for the sheet display
+        if 'Time' in chunk.columns:
+            chunk = chunk.assign(Time=chunk['Time'].dt.strftime('%m/%d/%y %H:%M:%S'))
+        # Compute Gain/Loss (USD) for each payout row using:
+        # Gain/Loss = Amount (BTC) * current BTC price - Cost Basis (USD)
+        if 'Amount (BTC)' in chunk.columns and current_btc_price:
+            amounts = pd.to_numeric(chunk['Amount (BTC)'], errors='coerce')
+            chunk = chunk.assign(**{'Gain/Loss (USD)': amounts * current_btc_price - chunk['Cost Basis (USD)']})
+        for row in zip(*(sheet_cells(chunk[col]) for col in chunk.columns)):
+            yield list(row)
+    yield payload['totals_row']
+
+def update_sheet_payouts(payload):
+    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+    creds = service_account.Credentials.from_service_account_info(
+        SERVICE_ACCOUNT_CREDS, scopes=SCOPES)
+    service = build('sheets', 'v4', credentials=creds)
+    
+    # Retrieve the sheetId for the "Payouts" sheet so that formatting only applies there
+    payouts_sheet_id = None
+    spreadsheet = service.spreadsheets().get(spreadsheetId=SHEET_ID).execute()
+    for sheet in spreadsheet.get("sheets", []):
+        if sheet["properties"]["title"] == "Payouts":
+            payouts_sheet_id = sheet["properties"]["sheetId"]
+            break
+    if payouts_sheet_id is None:
+        # If no "Payouts" sheet exists, create one.
+        add_sheet_request = {
             "requests": [
                 {
-                    "unmergeCells": {
-                        "range": {
-                            "sheetId": payouts_sheet_id,
-                            "startRowIndex": 0,
-                            "endRowIndex": len(values),
-                            "startColumnIndex": 0,
-                            "endColumnIndex": num_cols
+                    "addSheet": {
+                        "properties": {
+                            "title": "Payouts",
+                            "gridProperties": {
+                                "rowCount": 1000,
+                                "columnCount": 26
+                            }
                         }
                     }
                 }
             ]
         }
-    ).execute()
+        response = service.spreadsheets().batchUpdate(
+            spreadsheetId=SHEET_ID,
+            body=add_sheet_request
+        ).execute()
+        payouts_sheet_id = response["replies"][0]["addSheet"]["properties"]["sheetId"]
+        print("Created new 'Payouts' sheet with sheetId:", payouts_sheet_id)
+    
+    totals_row_index = payload['totals_row_index']
+    num_cols = len(payload['headers'])
+    current_btc_price, header_rows = get_report_header()
+
+    # Write the header rows, data rows, and totals row through a staging tab so a failed write
+    # never leaves the "Payouts" sheet empty or half updated. The report header rows are 11 cells wide.
+    write_sheet_staged(
+        service, payouts_sheet_id, 'Payouts', iter_payouts_rows(payload, current_btc_price, header_rows),
+        row_count=totals_row_index,
+        column_count=max(num_cols, 11)
+    )
 
     # Merge the first 4 cells of the totals row and apply bold text with right alignment on the Payouts sheet.
     service.spreadsheets().batchUpdate(
@@ -660,21 +863,44 @@ def update_sheet_payouts(data):
 
 def main():
     driver = None
+
+    def fetch(get_data):
+        # Only start a browser once a fetch stage actually has to run, including when its
+        # checkpoint turned out to be unusable
+        nonlocal driver
+        if driver is None:
+            driver = setup_driver()
+        return get_data(driver)
+
+    run_id = start_run()
     try:
-        driver = setup_driver()
-        print(f"Checking data at {datetime.now()}")
-        df = get_ocean_data(driver)
+        print(f"Checking data at {datetime.now()} (run {run_id})")
+        df = run_stage(run_id, "earnings_frame", fetch, get_ocean_data)
         if df is not None:  # Only update if we got earnings data
-            update_sheet(df)
+            prices = run_stage(run_id, "earnings_prices", get_earnings_prices, df)
+            blocks = run_stage(run_id, "earnings_blocks", get_earnings_blocks, df)
+            payload = run_stage(run_id, "earnings_payload", build_earnings_payload, df, prices, blocks)
+            update_sheet(payload)
+            clear_checkpoints(run_id, "earnings")
             print("Earnings data updated successfully")
             
         # New: Fetch and update payouts data
-        payouts_df = get_ocean_payouts(driver)
+        payouts_df = run_stage(run_id, "payouts_frame", fetch, get_ocean_payouts)
         if payouts_df is not None:
-            update_sheet_payouts(payouts_df)
+            prices = run_stage(run_id, "payouts_prices", get_payout_prices, payouts_df)
+            payload = run_stage(run_id, "payouts_payload", build_payouts_payload, payouts_df, prices)
+            update_sheet_payouts(payload)
+            clear_checkpoints(run_id, "payouts")
             print("Payouts data updated successfully")
+
+        # A fetch that returned None left no checkpoints behind, so there is nothing to resume
+        finish_run(run_id)
     except Exception as e:
         print(f"Error: {str(e)}")
+        if run_has_checkpoints(run_id):
+            print(f"Run {run_id} will resume from its last completed stage on the next run")
+        else:
+            finish_run(run_id)
     finally:
         if driver:
             driver.quit()